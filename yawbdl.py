@@ -1,140 +1,413 @@
 #!/usr/bin/env python3
 
 import requests
+from requests.adapters import HTTPAdapter
 from urllib.parse import urlparse
 from urllib.parse import urlsplit
+from urllib.parse import urlencode
 import sys
 import os
 import os.path as path
 import argparse
 import errno
 import time
+import random
+import threading
 import re
 import json
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
+from collections import Counter, deque
+from functools import lru_cache
+from operator import itemgetter
+from typing import Optional
+from dataclasses import dataclass
+from bisect import bisect_left, bisect_right
 
-parser = argparse.ArgumentParser(
-    description="Download a website from Internet Archive",
-    formatter_class=lambda prog: argparse.ArgumentDefaultsHelpFormatter(prog, width=80),
-)
-
-parser.add_argument("-d", dest="domain", help="domain to download")
-parser.add_argument("-o", dest="dst_dir", help="output directory")
-parser.add_argument(
-    "--from",
-    dest="from_date",
-    default=None,
-    help="from date, up to 14 digits: yyyyMMddhhmmss",
-)
-parser.add_argument("--to", dest="to_date", default=None, help="to date")
-parser.add_argument("--timeout", dest="timeout", default=10, help="request timeout")
-parser.add_argument("-n", action="store_true", help="dry run")
-parser.add_argument("--delay", default=1, help="delay between requests")
-parser.add_argument("--retries", default=0, help="max number of retries")
-parser.add_argument(
-    "--no-fail",
-    default=False,
-    action="store_true",
-    help="if retries are exceeded, and the file still couldn't have been downloaded, proceed to the next file instead of aborting the run",
-)
-parser.add_argument(
-    "--skip-timestamps",
-    default=None,
-    action="append",
-    nargs="+",
-    help="skip snapshots with these timestamps (sometimes Internet Archive just fails to serve a specific snapshot)",
-)
-
-args = parser.parse_args()
-
-if len(sys.argv) < 2:
-    parser.print_help(sys.stderr)
-    sys.exit(1)
-
-# init vars
-domain = args.domain
-DST_DIR = args.dst_dir
-from_date = args.from_date
-to_date = args.to_date
-timeout = int(args.timeout)
-dry_run = args.n
-DELAY = int(args.delay)
-RETRIES = int(args.retries)
-no_fail = args.no_fail
 try:
-    skip_timestamps = args.skip_timestamps[0]
-except:
-    skip_timestamps = []
+    # Optional, parses and serializes large snapshot lists several times faster
+    from orjson import loads as json_loads, dumps as json_dumps
+except ImportError:
+    from json import loads as json_loads
+
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode("utf-8")
 
-CDX_URL = "http://web.archive.org/cdx/search/cdx?"
-params = "output=json&url={}&matchType=host&filter=statuscode:200&fl=timestamp,original".format(domain)
-if from_date is not None:
-    params = params + "&from={}".format(from_date)
-if to_date is not None:
-    params = params + "&to={}".format(to_date)
 
+SUMMARY_EVERY = 100
+
+CDX_URL = "http://web.archive.org/cdx/search/cdx?"
+CDX_PAGE_SIZE = 100000
 vanilla_url = "http://web.archive.org/web/{}id_/{}"
+CHUNK_SIZE = 64 * 1024
+MAX_RETRY_DELAY = 60
+# Statuses of files saved or skipped as expected, hidden with -q
+ROUTINE_STATUSES = ("[OK]", "[Skip", "[Dry run]")
+# Throttling and transient server errors, worth retrying: Too Many Requests, Internal Server Error,
+# Bad Gateway, Service Unavailable, Gateway Timeout
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Reuse connections to web.archive.org, instead of a new TCP/TLS handshake for every file.
+# Connection pool is sized in main, to match concurrency.
+SESSION = requests.Session()
+SESSION.headers["User-Agent"] = "yawbdl (+https://github.com/BGforgeNet/yawbdl)"
+
+print_lock = threading.Lock()
+# Set when a file fails to download and the run is aborted, so that other workers stop too
+aborted = threading.Event()
+
+rate_lock = threading.Lock()
+next_request_time = 0.0
+
+# Directories already created, to skip repeated os.makedirs calls for files in the same directory
+made_dirs = set()
+# Files already on disk, per timestamp directory. Each directory is scanned once, on first access.
+files_on_disk = {}
+# (timestamp, normcased file path) of downloads in progress, also guarded by files_on_disk_lock
+files_in_flight = set()
+files_on_disk_lock = threading.Lock()
+# Notified when a download in progress is done, for workers waiting to download the same file from another url
+files_in_flight_done = threading.Condition(files_on_disk_lock)
+
+
+@dataclass(frozen=True)
+class Config:
+    """
+    Settings of a run, from command line options.
+    """
 
+    domain: str
+    dst_dir: str
+    from_date: Optional[str]
+    to_date: Optional[str]
+    timeout: int
+    dry_run: bool
+    quiet: bool
+    delay: int
+    retries: int
+    concurrency: int
+    rate: int
+    no_fail: bool
+    skip_timestamps: frozenset
+
+
+def parse_args(argv: Optional[list[str]] = None) -> Config:
+    """
+    Parse command line options, sys.argv by default. Prints help and exits if there are none.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+
+    parser = argparse.ArgumentParser(
+        prog="yawbdl",
+        description="Download a website from Internet Archive",
+        formatter_class=lambda prog: argparse.ArgumentDefaultsHelpFormatter(prog, width=80),
+    )
+
+    parser.add_argument("-d", dest="domain", help="domain to download")
+    parser.add_argument("-o", dest="dst_dir", help="output directory")
+    parser.add_argument(
+        "--from",
+        dest="from_date",
+        default=None,
+        help="from date, up to 14 digits: yyyyMMddhhmmss",
+    )
+    parser.add_argument("--to", dest="to_date", default=None, help="to date")
+    parser.add_argument("--timeout", dest="timeout", default=10, help="request timeout")
+    parser.add_argument("-n", action="store_true", help="dry run")
+    parser.add_argument(
+        "-q",
+        dest="quiet",
+        action="store_true",
+        help="only print errors and warnings for individual files, and a summary every {} files".format(SUMMARY_EVERY),
+    )
+    parser.add_argument("--delay", default=1, help="delay between requests")
+    parser.add_argument("--retries", default=0, help="max number of retries")
+    parser.add_argument("--concurrency", default=4, help="number of files to download in parallel")
+    parser.add_argument("--rate", default=0, help="max requests per minute, 0 for no limit")
+    parser.add_argument(
+        "--no-fail",
+        default=False,
+        action="store_true",
+        help="if retries are exceeded, and the file still couldn't have been downloaded, proceed to the next file instead of aborting the run",
+    )
+    parser.add_argument(
+        "--skip-timestamps",
+        default=None,
+        action="append",
+        nargs="+",
+        help="skip snapshots with these timestamps (sometimes Internet Archive just fails to serve a specific snapshot)",
+    )
+
+    args = parser.parse_args(argv)
+
+    if len(argv) == 0:
+        parser.print_help(sys.stderr)
+        sys.exit(1)
+
+    concurrency = int(args.concurrency)
+    if concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    rate = int(args.rate)
+    if rate < 0:
+        parser.error("--rate must not be negative")
+
+    # Set for constant time lookups, checked for every snapshot
+    if args.skip_timestamps is None:
+        skip_timestamps = frozenset()
+    else:
+        skip_timestamps = frozenset(ts for group in args.skip_timestamps for ts in group)
+
+    return Config(
+        domain=args.domain,
+        dst_dir=args.dst_dir,
+        from_date=args.from_date,
+        to_date=args.to_date,
+        timeout=int(args.timeout),
+        dry_run=args.n,
+        quiet=args.quiet,
+        delay=int(args.delay),
+        retries=int(args.retries),
+        concurrency=concurrency,
+        rate=rate,
+        no_fail=args.no_fail,
+        skip_timestamps=skip_timestamps,
+    )
+
+
+def get_cdx_params(config: Config) -> str:
+    """
+    Get CDX query string for snapshots of config.domain.
+    """
+    cdx_params = {
+        "output": "json",
+        "url": config.domain,
+        "matchType": "host",
+        "filter": "statuscode:200",
+        "fl": "timestamp,original",
+        "limit": CDX_PAGE_SIZE,
+        "showResumeKey": "true",
+    }
+    if config.from_date is not None:
+        cdx_params["from"] = config.from_date
+    if config.to_date is not None:
+        cdx_params["to"] = config.to_date
+    return urlencode(cdx_params)
+
+
+def wait_for_rate_limit(rate: int):
+    """
+    Space out requests evenly to make at most rate per minute, shared by all workers.
+    """
+    global next_request_time
+    if not rate:
+        return
+    with rate_lock:
+        now = time.monotonic()
+        wait = next_request_time - now
+        next_request_time = max(now, next_request_time) + 60 / rate
+    if wait > 0:
+        time.sleep(wait)
 
-def get_snapshot_list():
+
+def get_retry_delay(delay: int, retry_count: int, resp=None) -> float:
     """
-    Load cached snapshot list. If not available, get it from IA.
+    Get delay before a retry. Honors Retry-After header of the failed response, if the server sent one.
+    Otherwise backs off exponentially, with jitter so that parallel downloads don't retry all at once.
+    Either way, waits at most MAX_RETRY_DELAY seconds.
+
+    Args:
+        delay: base delay, from --delay
+        retry_count: number of the upcoming retry, starting from 1
+        resp: failed response, if there was one
+
+    Returns:
+        float: delay in seconds.
+    """
+    if resp is not None:
+        retry_after = resp.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return float(min(int(retry_after), MAX_RETRY_DELAY))
+    if not delay:
+        return 0
+    return min(delay * 2**retry_count + random.uniform(0, delay), MAX_RETRY_DELAY)
+
+
+def get_snapshot_page(config: Config, resume_key: Optional[str]):
+    """
+    Get up to CDX_PAGE_SIZE snapshots from IA, starting at resume_key.
+
+    Returns:
+        tuple: snapshot rows (with header), and resume key of the next page, or None if this was the last one.
+    """
+    url = CDX_URL + get_cdx_params(config)
+    if resume_key is not None:
+        # CDX prints the key already url-encoded
+        url = url + "&resumeKey={}".format(resume_key)
+    retry_count = 0
+    while retry_count <= config.retries:
+        try:
+            wait_for_rate_limit(config.rate)
+            resp = SESSION.get(url, timeout=config.timeout)
+            if resp.status_code in RETRY_STATUSES and retry_count < config.retries:
+                raise requests.HTTPError("HTTP {}".format(resp.status_code), response=resp)
+            break
+        except requests.RequestException as exc:
+            if retry_count < config.retries:
+                retry_count += 1
+                new_delay = get_retry_delay(config.delay, retry_count, exc.response)
+                print(
+                    "    failed to get snapshot list, retrying after {:.1f} seconds... ".format(new_delay),
+                    flush=True,
+                )
+                time.sleep(new_delay)
+            else:
+                print("    failed to get snapshot list, aborting!")
+                sys.exit(1)
+
+    code = resp.status_code
+    if resp.status_code != 200:
+        print(f"[Error: {code}]")
+        print("    failed to get snapshot list, aborting!")
+        sys.exit(1)
+    page = json_loads(resp.content)
+    # With showResumeKey, a page that isn't the last one ends with an empty row and the key
+    if len(page) >= 2 and page[-2] == []:
+        resume_key = page[-1][0]
+        del page[-2:]
+    else:
+        resume_key = None
+    return page, resume_key
+
+
+def get_snapshot_list(config: Config):
+    """
+    Load cached snapshot list. If not available, get it from IA, page by page.
     """
     print("Getting snapshot list...")
 
     # Try cached snapshots
-    snapshots_path = path.join(DST_DIR, "snapshots.json")
+    snapshots_path = path.join(config.dst_dir, "snapshots.json")
+    snap_list = None
     try:
-        with open(snapshots_path) as fh:
-            snap_list = json.load(fh)
+        with open(snapshots_path, "rb") as fh:
+            snap_list = json_loads(fh.read())
         print("Found cached snapshots.json")
-    except:
+    except FileNotFoundError:
+        pass
+    except ValueError as exc:
+        # Keep the broken file around for inspection, and get a new list
+        print("[Warning: cached snapshots.json is corrupt, moving it to snapshots.json.bad: {}]".format(exc))
+        os.replace(snapshots_path, snapshots_path + ".bad")
+
+    if snap_list is None:
         # No cache, downloading
-        url = CDX_URL + params
-        retry_count = 0
-        while retry_count <= RETRIES:
-            try:
-                if DELAY:
-                    time.sleep(DELAY * 2 * retry_count)  # increase delay with each try
-                resp = requests.get(url, timeout=timeout)
-                break
-            except Exception:
-                if retry_count < RETRIES:
-                    retry_count += 1
-                    new_delay = DELAY * 2 * retry_count
-                    print(
-                        "    failed to get snapshot list, retrying after {} seconds... ".format(new_delay),
-                        flush=True,
-                    )
-                else:
-                    print("    failed to get snapshot list, aborting!")
-                    sys.exit(1)
-
-        code = resp.status_code
-        if resp.status_code != 200:
-            print(f"[Error: {code}]")
-            print("    failed to get snapshot list, aborting!")
-            sys.exit(1)
-        snap_list = resp.json()
-        os.makedirs(DST_DIR, exist_ok=True)
-        with open(snapshots_path, "w") as fh:
-            json.dump(snap_list, fh)
+        snap_list, resume_key = get_snapshot_page(config, None)
+        while resume_key is not None:
+            print("    got {} snapshots so far...".format(len(snap_list) - 1), flush=True)
+            page, resume_key = get_snapshot_page(config, resume_key)
+            snap_list.extend(page[1:])  # skip header
+        # CDX orders snapshots by url. Cache them ordered by timestamp,
+        # so that on later runs the sort below only takes a linear pass.
+        snap_list[1:] = sorted(snap_list[1:], key=itemgetter(0))
+        os.makedirs(config.dst_dir, exist_ok=True)
+        # Replace atomically, so that an interrupted write doesn't leave a truncated cache
+        with open(snapshots_path + ".part", "wb") as fh:
+            fh.write(json_dumps(snap_list))
+        os.replace(snapshots_path + ".part", snapshots_path)
 
     if len(snap_list) == 0:
         print("Sorry, no snapshots found!")
         sys.exit(0)
     del snap_list[0]  # delete header
-    snap_list.sort(key=lambda row: row[0])  # sort by timestamp
+    snap_list.sort(key=itemgetter(0))  # sort by timestamp
+    snap_list = filter_by_date(snap_list, config.from_date, config.to_date)
     print("Got snapshot list!")
     return snap_list
 
 
-def download_files(snapshot_list):
+def filter_by_date(snap_list, from_date: Optional[str], to_date: Optional[str]):
+    """
+    Keep only snapshots between from_date and to_date.
+    CDX already filters by date, but cached snapshots.json could have been fetched for a wider range.
+
+    Args:
+        snap_list: snapshots sorted by timestamp
+
+    Returns:
+        list: a slice of snap_list.
+    """
+    timestamps = [row[0] for row in snap_list]
+    # Pad partial dates the same way CDX does: "2010" is from 20100000000000 or to 20109999999999
+    lo = 0 if from_date is None else bisect_left(timestamps, from_date.ljust(14, "0"))
+    hi = len(timestamps) if to_date is None else bisect_right(timestamps, to_date.ljust(14, "9"))
+    return snap_list[lo:hi]
+
+
+def download_files(config: Config, snapshot_list):
+    # Leave out files saved by previous runs, so that progress reflects the remaining work
+    pending = [snap for snap in snapshot_list if not is_on_disk(config.dst_dir, snap[0], get_file_path(snap[1]))]
+    if len(pending) < len(snapshot_list):
+        print("Skipping {} files already on disk".format(len(snapshot_list) - len(pending)))
+    snapshot_list = pending
+
     total = len(snapshot_list)
-    i = 0
-    for snap in snapshot_list:
-        i += 1
-        print("({}/{}) ".format(i, total), end="")
-        download_file(snap)
+    counts = Counter()
+    with ThreadPoolExecutor(max_workers=config.concurrency) as executor:
+        # Consume results, so that an aborted download (sys.exit in a worker) stops the run
+        results = map_bounded(
+            executor,
+            download_file,
+            config.concurrency * 2,
+            repeat(config),
+            snapshot_list,
+            range(1, total + 1),
+            repeat(total),
+        )
+        try:
+            for i, status in enumerate(results, 1):
+                if not config.quiet or status is None:
+                    continue
+                # "[Skip: already on disk]" -> "Skip"
+                counts[status[1:].split(":")[0].rstrip("]")] += 1
+                if i % SUMMARY_EVERY == 0 or i == total:
+                    summary = ", ".join("{}: {}".format(kind, count) for kind, count in sorted(counts.items()))
+                    print_status("({}/{})".format(i, total), summary)
+        except BaseException:
+            # Abort or Ctrl-C: drop queued downloads and stop running ones, instead of waiting for all of them
+            # on leaving the with block
+            aborted.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+
+def map_bounded(executor, fn, window: int, *iterables):
+    """
+    Like executor.map, but with at most window calls submitted at a time.
+    executor.map submits everything upfront, a future per snapshot, which takes gigabytes for millions of them.
+
+    Returns:
+        iterator: results in order. Exceptions raised by fn are re-raised when their result is reached.
+    """
+    futures = deque()
+    for args in zip(*iterables):
+        futures.append(executor.submit(fn, *args))
+        if len(futures) >= window:
+            yield futures.popleft().result()
+    while futures:
+        yield futures.popleft().result()
+
+
+if os.name == "nt":  # Windows
+    # Windows restricted characters
+    RESTRICTED_CHARS = re.compile(r'[\\|:"*<>\x00-\x1F\x80-\x9F]')
+else:  # Unix-like systems
+    # Unix restricted characters (excluding '/')
+    RESTRICTED_CHARS = re.compile(r"[\x00-\x1F\x80-\x9F]")
+
+
+def escape_char(match: re.Match) -> str:
+    return f"%{ord(match.group(0)):02X}"
 
 
 def url_to_path(url: str) -> str:
@@ -149,19 +422,16 @@ def url_to_path(url: str) -> str:
     Returns:
         str: The converted filename.
     """
-    if os.name == "nt":  # Windows
-        # Escape Windows restricted characters
-        restricted_chars = r'[\\|:"*<>\x00-\x1F\x80-\x9F]'
-        escaped_url = re.sub(restricted_chars, lambda match: f"%{ord(match.group(0)):02X}", url)
+    # Most urls have nothing to escape, and search is cheaper than sub
+    escaped_url = RESTRICTED_CHARS.sub(escape_char, url) if RESTRICTED_CHARS.search(url) else url
+    if os.name == "nt":
         # Replace '?' with '@' for query portion separation
         escaped_url = escaped_url.replace("?", "@")
-    else:  # Unix-like systems
-        # Escape Unix restricted characters (excluding '/')
-        restricted_chars = r"[\x00-\x1F\x80-\x9F]"
-        escaped_url = re.sub(restricted_chars, lambda match: f"%{ord(match.group(0)):02X}", url)
     return escaped_url
 
 
+# Same urls repeat across many timestamps
+@lru_cache(maxsize=65536)
 def get_file_path(original_url: str) -> str:
     url = urlsplit(original_url)
     fpath = url.path.lstrip("/")
@@ -178,112 +448,238 @@ def get_file_path(original_url: str) -> str:
     return fpath
 
 
-def download_file(snap: tuple[str, str]):
+def scan_files(dirname: str, prefix: str = "") -> set[str]:
+    """
+    Recursively list files in a directory.
+
+    Returns:
+        set[str]: paths relative to dirname, "/"-separated like get_file_path returns them, in normcase.
+    """
+    files = set()
+    try:
+        with os.scandir(dirname) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    files |= scan_files(entry.path, prefix + entry.name + "/")
+                elif entry.is_file():
+                    files.add(path.normcase(prefix + entry.name))
+    except FileNotFoundError:
+        pass
+    return files
+
+
+def is_on_disk(dst_dir: str, timestamp: str, file_path: str) -> bool:
+    """
+    Check if file_path from get_file_path is already saved for timestamp in dst_dir.
+    Uses a single directory scan per timestamp instead of a stat call per file.
+    """
+    with files_on_disk_lock:
+        files = files_on_disk.get(timestamp)
+        if files is None:
+            files = files_on_disk[timestamp] = scan_files(path.join(dst_dir, timestamp))
+    return path.normcase(file_path) in files
+
+
+def print_status(line: str, status: str):
+    """
+    Print the status of a snapshot as a single line, so that output of parallel downloads doesn't interleave.
+    Routine statuses are left to stdout buffering, to avoid a write call per file when output is redirected.
+    """
+    flush = not status.startswith(ROUTINE_STATUSES)
+    with print_lock:
+        try:
+            print(line, status, flush=flush)
+        except Exception:
+            # Some urls may be malformed and can't be printed with non-UTF-8 encodings.
+            # See https://github.com/BGforgeNet/yawbdl/issues/5
+            print(
+                "[Error: malformed url, can't print. Set PYTHONUTF8=1 environment variable to see it.]",
+                status,
+                flush=flush,
+            )
+
+
+def print_result(line: str, status: str, quiet: bool) -> str:
+    """
+    Print the final status of a snapshot, unless it's routine and output is quiet.
+
+    Returns:
+        str: status, for download_files to count.
+    """
+    if not (quiet and status.startswith(ROUTINE_STATUSES)):
+        print_status(line, status)
+    return status
+
+
+def download_file(config: Config, snap: tuple[str, str], index: int, total: int) -> Optional[str]:
     """
     Download and save a single original URL at TIMESTAMP to the destination directory.
-    Will retry RETRIES times.
+    Will retry config.retries times on network errors and RETRY_STATUSES responses.
 
     Args:
+        config: settings of the run
         snap: [timestamp, original_url]
+        index: position of the snapshot in the list, for progress output
+        total: length of the snapshot list
 
+    Returns:
+        str: final status, or None if the run was aborted before it was known.
     """
     timestamp: str = snap[0]
     original_url: str = snap[1]
+    line = "({}/{}) {} {} ".format(index, total, timestamp, original_url)
+    if aborted.is_set():
+        return
 
-    # Some urls may be malformed and can't be printed with non-UTF-8 encodings.
-    # See https://github.com/BGforgeNet/yawbdl/issues/5
-    try:
-        print(timestamp, original_url, " ", end="", flush=True)
-    except Exception as e:
-        print(f"[Error: malformed url, can't print. Set PYTHONUTF8=1 environment variable to see it.]")
+    if timestamp in config.skip_timestamps:
+        return print_result(line, "[Skip: by timestamp command line option]", config.quiet)
+
+    file_path = get_file_path(original_url)
+    if is_on_disk(config.dst_dir, timestamp, file_path):
+        return print_result(line, "[Skip: already on disk]", config.quiet)
+
+    if config.dry_run:
+        return print_result(line, "[Dry run]", config.quiet)
+
+    # Different urls can map to the same file: duplicate CDX rows, or http and https variants, which are
+    # usually next to each other in the list and so run in parallel. Only one of them may download it at a time,
+    # the others wait for it, and try their url if it failed.
+    file_key = (timestamp, path.normcase(file_path))
+    with files_in_flight_done:
+        while file_key in files_in_flight:
+            files_in_flight_done.wait()
+        if aborted.is_set():
+            return
+        if file_key[1] in files_on_disk[timestamp]:
+            status = "[Skip: already on disk]"
+        else:
+            status = None
+            files_in_flight.add(file_key)
+    if status is not None:
+        return print_result(line, status, config.quiet)
 
-    if timestamp in skip_timestamps:
-        print("[Skip: by timestamp command line option]")
+    try:
+        status = fetch_file(config, line, timestamp, original_url, file_path)
+    finally:
+        with files_in_flight_done:
+            files_in_flight.discard(file_key)
+            if status == "[OK]":
+                files_on_disk[timestamp].add(file_key[1])
+            files_in_flight_done.notify_all()
+    if status is None:
         return
+    return print_result(line, status, config.quiet)
 
-    fpath = path.join(DST_DIR, timestamp, get_file_path(original_url))
-    if path.isfile(fpath):
-        print("[Skip: already on disk]")
-        return
 
-    if dry_run:
-        print("")  # carriage return
-    else:
-        retry_count = 0
-        url = vanilla_url.format(timestamp, original_url)
-        while retry_count <= RETRIES:
-            try:
-                if DELAY:
-                    time.sleep(DELAY * 2 * retry_count)  # increase delay with each try
-                resp = requests.get(url, timeout=timeout)
-                break
-            except Exception:
-                if retry_count < RETRIES:
-                    retry_count += 1
-                    new_delay = DELAY * 2 * retry_count
-                    print(
-                        "    failed to download, retrying after {} seconds... ".format(new_delay),
-                        flush=True,
-                    )
+def fetch_file(config: Config, line: str, timestamp: str, original_url: str, file_path: str) -> Optional[str]:
+    """
+    Download a snapshot and save it, retrying as configured. Exits if it can't be downloaded, unless --no-fail.
+
+    Returns:
+        str: final status, or None if the run was aborted before it was known.
+    """
+    fpath = path.join(config.dst_dir, timestamp, file_path)
+    retry_count = 0
+    url = vanilla_url.format(timestamp, original_url)
+    while retry_count <= config.retries:
+        try:
+            wait_for_rate_limit(config.rate)
+            with SESSION.get(url, timeout=config.timeout, stream=True) as resp:
+                code = resp.status_code
+                if code in RETRY_STATUSES and retry_count < config.retries:
+                    raise requests.HTTPError("HTTP {}".format(code), response=resp)
+                if code != 200:
+                    status = "[Error: {}]".format(code)
                 else:
-                    if no_fail:
-                        print(
-                            "    failed to download, proceeding to next file",
-                            flush=True,
-                        )
-                        return
-                    else:
-                        print("    failed to download, aborting", flush=True)
-                        sys.exit(1)
-
-        code = resp.status_code
-        if code != 200:
-            print("[Error: {}]".format(code), flush=True)
-        else:
-            content = resp.content
-            if len(content) == 0:
-                print("[Skip: file size is 0]", flush=True)
+                    status = write_file(fpath, resp)
+            break
+        except requests.RequestException as exc:
+            if retry_count < config.retries:
+                retry_count += 1
+                new_delay = get_retry_delay(config.delay, retry_count, exc.response)
+                print_status(line, "[Warning: failed to download, retrying after {:.1f} seconds]".format(new_delay))
+                if aborted.wait(new_delay):
+                    return
             else:
-                write_file(fpath, content)
+                if config.no_fail:
+                    return "[Error: failed to download, proceeding to next file]"
+                else:
+                    print_status(line, "[Error: failed to download, aborting]")
+                    aborted.set()
+                    sys.exit(1)
+    return status
+
+
+def write_file(fpath: str, resp: requests.Response) -> str:
+    """
+    Stream response body to fpath in chunks, creating parent directories as needed.
+    The body is saved to a temporary file in the same directory and renamed to fpath once complete.
+    Network errors are re-raised after removing the partial file, so that the download can be retried.
 
+    Returns:
+        str: status to print for the snapshot.
+    """
+    if resp.headers.get("Content-Length") == "0":
+        return "[Skip: file size is 0]"
 
-def write_file(fpath, content):
     dirname, basename = path.split(fpath)
 
-    if path.isfile(dirname):
-        print(
-            "[Warning] file {} already exists, can't create directory with the same name for {}".format(
+    if dirname not in made_dirs:
+        if path.isfile(dirname):
+            return "[Warning: file {} already exists, can't create directory with the same name for {}]".format(
                 dirname, basename
-            ),
-            flush=True,
-        )
-        return
-    too_long = False
-    try:
-        os.makedirs(dirname, exist_ok=True)
-    except OSError as exc:
-        if exc.errno == errno.ENAMETOOLONG:
-            print("[Error: dir name too long, skipped]", flush=True)
-            too_long = True
-        else:
-            raise
-    if not too_long:
+            )
         try:
-            with open(fpath, "wb") as file:
-                file.write(content)
+            os.makedirs(dirname, exist_ok=True)
+        except (FileExistsError, NotADirectoryError):
+            # A file with the same name as dirname or one of its parents, saved by another worker since the check
+            return "[Warning: file in the way already exists, can't create directory {} for {}]".format(
+                dirname, basename
+            )
         except OSError as exc:
             if exc.errno == errno.ENAMETOOLONG:
-                print("[Error: file name too long, skipped]", flush=True)
-                too_long = True
-            else:
-                raise
-        print("[OK]", flush=True)
+                return "[Error: dir name too long, skipped]"
+            raise
+        # Ancestors exist now too, so files saved directly in them don't need the checks either
+        parent = dirname
+        while parent and parent not in made_dirs:
+            made_dirs.add(parent)
+            parent = path.dirname(parent)
+
+    # Write to a temporary file first, so that an interrupted download doesn't look complete on the next run.
+    # The name is short, to fit NAME_MAX however long basename is, and unique to this process and thread,
+    # so that parallel writers never share it.
+    part_path = path.join(dirname, ".yawbdl-{}-{}.part".format(os.getpid(), threading.get_ident()))
+    size = 0
+    try:
+        with open(part_path, "wb") as file:
+            for chunk in resp.iter_content(CHUNK_SIZE):
+                size += file.write(chunk)
+        if size == 0:
+            os.remove(part_path)
+            return "[Skip: file size is 0]"
+        os.replace(part_path, fpath)
+    except OSError as exc:  # also requests.RequestException from iter_content, re-raised for a retry
+        if path.exists(part_path):
+            os.remove(part_path)
+        if exc.errno == errno.ENAMETOOLONG:
+            return "[Error: file name too long, skipped]"
+        if isinstance(exc, IsADirectoryError):
+            # Another worker saved a file under a url one level deeper, and created a directory with this name
+            return "[Warning: directory {} already exists, can't save file with the same name]".format(fpath)
+        raise
+    return "[OK]"
 
 
 def main():
-    snap_list = get_snapshot_list()
-    download_files(snap_list)
-    if dry_run:
+    config = parse_args()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config.concurrency, max_retries=0)
+    SESSION.mount("http://", adapter)
+    SESSION.mount("https://", adapter)
+
+    snap_list = get_snapshot_list(config)
+    download_files(config, snap_list)
+    if config.dry_run:
         print("Dry run completed.")
 
 